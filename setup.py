@@ -38,6 +38,11 @@ setup(
     package_dir={'yowsup-gateway':
                  'yowsup_gateway'},
     include_package_data=True,
+    entry_points={
+        'console_scripts': [
+            'yowsup-gateway=yowsup_gateway.daemon:main',
+        ],
+    },
     install_requires=requirements,
     license="ISCL",
     zip_safe=False,
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cache
+----------------------------------
+
+Tests for `yowsup_gateway` caches.
+"""
+
+import unittest
+from yowsup_gateway.cache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(2)
+
+    def test_get_set(self):
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("b", 2), 2)
+
+    def test_discard_least_recently_used(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache)
+        self.assertEqual(len(self.cache), 2)
+
+    def test_delete(self):
+        self.cache.set("a", 1)
+        self.cache.delete("a")
+        self.cache.delete("a")
+        self.assertNotIn("a", self.cache)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_daemon
+----------------------------------
+
+Tests for `yowsup_gateway` daemon.
+"""
+
+import threading
+import unittest
+from yowsup.layers.protocol_messages.protocolentities import TextMessageProtocolEntity
+from yowsup_gateway.daemon import GatewayDaemon, ThreadingHTTPServer, submit
+from yowsup_gateway.exceptions import ConnectionError
+from yowsup_gateway.results import SuccessfulResult
+from tests import ack_incoming_protocol_entity
+
+
+class GatewayMock(object):
+
+    def __init__(self):
+        self.batches = []
+        self.error = False
+
+    def send_messages(self, messages):
+        self.batches.append(messages)
+        if self.error:
+            raise ConnectionError("Pending incoming Ack messages not received")
+        outbox = [TextMessageProtocolEntity(content, to=number + "@s.whatsapp.net")
+                  for number, content in messages]
+        inbox = [ack_incoming_protocol_entity(message) for message in outbox[:-1]]
+        return SuccessfulResult(inbox, outbox)
+
+
+class GatewayDaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gateway = GatewayMock()
+        self.daemon = GatewayDaemon(self.gateway, window=0.2)
+        self.daemon.start()
+        self.addCleanup(self.daemon.stop)
+
+    def test_coalesce_submissions(self):
+        first = self.daemon.submit([("341111111", "one"), ("342222222", "two")])
+        second = self.daemon.submit([("343333333", "three")])
+        self.assertEqual(len(first.wait(5)), 2)
+        statuses = second.wait(5)
+        self.assertEqual(len(self.gateway.batches), 1)
+        self.assertEqual(len(self.gateway.batches[0]), 3)
+        self.assertEqual([status["status"] for status in first.statuses], ["acked", "acked"])
+        self.assertEqual(statuses[0]["number"], "343333333")
+        self.assertEqual(statuses[0]["status"], "sent")
+
+    def test_window_error(self):
+        self.gateway.error = True
+        statuses = self.daemon.submit([("341111111", "one")]).wait(5)
+        self.assertEqual(statuses[0]["status"], "error")
+
+    def test_http_submit(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), self.daemon)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        statuses = submit([["341111111", "one"], ["342222222", "two"]], port=server.server_address[1])
+        self.assertEqual([status["status"] for status in statuses], ["acked", "sent"])
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_encryption
+----------------------------------
+
+Tests for `yowsup_gateway` encryption layer and cached axolotl store.
+"""
+
+import unittest
+from axolotl.state.sessionrecord import SessionRecord
+from axolotl.state.sessionstate import SessionState
+from yowsup.layers import YowProtocolLayerTest, YowLayerEvent
+from yowsup.layers.protocol_messages.protocolentities import TextMessageProtocolEntity
+from yowsup_gateway.cache import LRUCache
+from yowsup_gateway.layer import GatewayLayer
+from .test_gateway_layer import DummyStack
+try:
+    from yowsup_gateway.encryption import CachedAxolotlStore, GatewayAxolotlLayer
+except ImportError:
+    # yowsup releases without YowAxolotlLayer
+    CachedAxolotlStore = None
+    GatewayAxolotlLayer = object
+
+
+def session_record():
+    state = SessionState()
+    state.setSessionVersion(3)
+    return SessionRecord(sessionState=state)
+
+
+class IdentityKey(object):
+
+    def __init__(self, serialized):
+        self.serialized = serialized
+
+    def serialize(self):
+        return self.serialized
+
+
+class FakeStore(object):
+    """
+    Axolotl store counting lookups
+    """
+
+    def __init__(self, sessions=(), identities=None):
+        self.sessions = dict((key, session_record().serialize()) for key in sessions)
+        self.identities = identities or {}
+        self.lookups = 0
+
+    def loadSession(self, recipientId, deviceId):
+        self.lookups += 1
+        serialized = self.sessions.get((recipientId, deviceId))
+        return SessionRecord(serialized=serialized) if serialized else SessionRecord()
+
+    def containsSession(self, recipientId, deviceId):
+        self.lookups += 1
+        return (recipientId, deviceId) in self.sessions
+
+    def storeSession(self, recipientId, deviceId, sessionRecord):
+        self.sessions[(recipientId, deviceId)] = sessionRecord.serialize()
+
+    def deleteSession(self, recipientId, deviceId):
+        self.sessions.pop((recipientId, deviceId), None)
+
+    def deleteAllSessions(self, recipientId):
+        for key in [key for key in self.sessions if key[0] == recipientId]:
+            del self.sessions[key]
+
+    def saveIdentity(self, recipientId, identityKey):
+        self.identities[recipientId] = identityKey.serialize()
+
+    def isTrustedIdentity(self, recipientId, identityKey):
+        self.lookups += 1
+        return self.identities.get(recipientId, identityKey.serialize()) == identityKey.serialize()
+
+    def getLocalRegistrationId(self):
+        return 1
+
+
+@unittest.skipIf(CachedAxolotlStore is None, "yowsup without axolotl layer")
+class CachedAxolotlStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeStore(sessions=[("341111111", 1)])
+        self.store = CachedAxolotlStore(self.backend, LRUCache(10), LRUCache(10))
+
+    def test_sessions_on_disk_cached_on_first_read(self):
+        self.assertTrue(self.store.containsSession("341111111", 1))
+        lookups = self.backend.lookups
+        self.assertTrue(self.store.containsSession("341111111", 1))
+        self.assertFalse(self.store.loadSession("341111111", 1).isFresh())
+        self.assertEqual(self.backend.lookups, lookups)
+
+    def test_missing_session_not_cached(self):
+        self.assertTrue(self.store.loadSession("342222222", 1).isFresh())
+        self.assertFalse(self.store.containsSession("342222222", 1))
+        self.assertNotIn(("342222222", 1), self.store.sessions)
+
+    def test_store_and_delete_sessions(self):
+        self.store.storeSession("342222222", 1, session_record())
+        self.assertIn(("342222222", 1), self.backend.sessions)
+        self.assertTrue(self.store.containsSession("342222222", 1))
+        self.store.deleteAllSessions("342222222")
+        self.assertFalse(self.store.containsSession("342222222", 1))
+        self.assertTrue(self.store.containsSession("341111111", 1))
+
+    def test_trusted_identity(self):
+        self.store.saveIdentity("341111111", IdentityKey(b"key"))
+        lookups = self.backend.lookups
+        self.assertTrue(self.store.isTrustedIdentity("341111111", IdentityKey(b"key")))
+        self.assertEqual(self.backend.lookups, lookups)
+        self.assertFalse(self.store.isTrustedIdentity("341111111", IdentityKey(b"other")))
+
+    def test_delegates(self):
+        self.assertEqual(self.store.getLocalRegistrationId(), 1)
+
+
+@unittest.skipIf(CachedAxolotlStore is None, "yowsup without axolotl layer")
+class GatewayAxolotlLayerTest(YowProtocolLayerTest, GatewayAxolotlLayer):
+
+    def setUp(self):
+        GatewayAxolotlLayer.__init__(self)
+        self.setStack(DummyStack())
+        self.setProp(GatewayAxolotlLayer.PROP_PREFETCH_BATCH, 2)
+        self.backend = FakeStore(sessions=[("341111111", 1)])
+        self.store = self.backend
+
+    def tearDown(self):
+        pass
+
+    def requested_jids(self):
+        return [self.iqRegistry[node["id"]][0].getJids() for node in self.lowerSink]
+
+    def test_store_wrapped(self):
+        self.assertIsInstance(self.store, CachedAxolotlStore)
+        self.assertIs(self.store.store, self.backend)
+
+    def test_prefetch_batches(self):
+        jids = ["34111111%d@s.whatsapp.net" % i for i in range(1, 5)]
+        self.onEvent(YowLayerEvent(GatewayLayer.EVENT_PREFETCH_KEYS, jids=jids + jids[1:2]))
+        # 341111111 has a session already
+        self.assertEqual(self.requested_jids(), [jids[1:3], jids[3:]])
+        self.assertEqual(self.prefetching, set(jids[1:]))
+        # jids being prefetched are not requested again
+        self.onEvent(YowLayerEvent(GatewayLayer.EVENT_PREFETCH_KEYS, jids=jids))
+        self.assertEqual(len(self.lowerSink), 2)
+
+    def test_messages_held_until_keys(self):
+        jid = "341111112@s.whatsapp.net"
+        self.prefetch_keys([jid])
+        iq_node = self.lowerSink.pop()
+        message = TextMessageProtocolEntity("Hello", to=jid).toProtocolTreeNode()
+        self.send(message)
+        self.assertEqual(self.lowerSink, [])
+        self.assertEqual(self.pendingMessages[jid], [message])
+        # prefetch failed, held message asks for keys on its own
+        self.on_prefetch_error(None, self.iqRegistry.pop(iq_node["id"])[0])
+        self.assertEqual(self.prefetching, set())
+        self.assertEqual(self.requested_jids(), [[jid]])
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
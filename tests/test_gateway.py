@@ -10,6 +10,7 @@ Tests for `yowsup_gateway` module.
 import unittest
 import inspect
 import threading
+import time
 from yowsup.layers.interface import YowInterfaceLayer
 from yowsup.layers.network import YowNetworkLayer
 from yowsup.layers import YowLayerEvent, EventCallback
@@ -99,15 +100,22 @@ class CoreLayerMock(YowInterfaceLayer):
     def receive_receipt(self):
         self.toUpper(receipt_incoming_protocol_entity())
         
+def mock_stack():
+    """
+    Gateway with core layers replaced by :class:`CoreLayerMock`
+    """
+    stack = YowsupGateway(("341111111", "password"))
+    stackClassesArr = (GatewayLayer, CoreLayerMock)
+    stack._YowStack__stack = stackClassesArr[::-1]
+    stack._YowStack__stackInstances = []
+    stack._YowStack__props = {}
+    stack._construct()
+    return stack
+
 class FunctionalTests(unittest.TestCase):
     
     def setUp(self):
-        self.stack = YowsupGateway(("341111111", "password"))
-        stackClassesArr = (GatewayLayer, CoreLayerMock)   
-        self.stack._YowStack__stack = stackClassesArr[::-1]
-        self.stack._YowStack__stackInstances = []
-        self.stack._YowStack__props = {}
-        self.stack._construct()
+        self.stack = mock_stack()
         self.mock_layer = self.stack._YowStack__stackInstances[0]
         self.gateway_layer = self.stack._YowStack__stackInstances[1]
         self.number = "341234567"
@@ -182,6 +190,50 @@ class FunctionalTests(unittest.TestCase):
         self.assertEqual(in_receipt.getFrom(), out_ack._to)
         self.assertEqual(out_ack.getClass(), "receipt")
 
+    def test_receive_persistent_session(self):
+        self.input_thread = threading.Thread(target=self._queue_thread, args=(self.mock_layer.receive_message,))
+        self.input_thread.daemon = True
+        self.input_thread.start()
+        result = self.stack.receive_messages(since=0, max_wait=5)
+        self.assertEqual(1, len(result.inbox))
+        self.assertEqual(1, result.cursor)
+        self.assertEqual(result.inbox[0].getBody(), text_message_protocol_entity().getBody())
+        self.assertTrue(self.gateway_layer.connected)
+        result = self.stack.receive_messages(since=result.cursor, max_wait=0.1)
+        self.assertEqual([], result.inbox)
+        self.assertEqual(1, result.cursor)
+        with self.assertRaises(ConnectionError):
+            self.stack.send_messages([self.message])
+        self.stack.close()
+        self.assertIsNone(self.stack.session)
+        self.assertFalse(self.gateway_layer.connected)
+
+    def test_send_twice(self):
+        first = self.stack.send_messages([self.message])
+        second = self.stack.send_messages([(self.number, "other")])
+        self.assertEqual([message.getBody() for message in first.outbox], [self.content])
+        self.assertEqual([message.getBody() for message in second.outbox], ["other"])
+        self.assertEqual(len(second.inbox), 1)
+
+    def test_pending_acks_not_inherited(self):
+        self.mock_layer.error_ack = True
+        with self.assertRaises(ConnectionError):
+            self.stack.send_messages([self.message])
+        self.mock_layer.error_ack = False
+        result = self.stack.send_messages([self.message])
+        self.assertTrue(result.is_success)
+
+    def test_scheduled_messages(self):
+        self.stack.schedule_messages([(self.number, self.content, time.time())])
+        self.stack.open()
+        start = time.time()
+        while not self.gateway_layer.outbox and time.time() - start < 5:
+            time.sleep(0.01)
+        self.stack.close()
+        self.assertEqual(len(self.stack.scheduler), 0)
+        self.assertEqual(self.gateway_layer.outbox[0].getBody(), self.content)
+        self.assertEqual(self.gateway_layer.ack_pending, [])
+
 if __name__ == '__main__':
     import sys
     sys.exit(unittest.main())
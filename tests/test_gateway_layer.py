@@ -10,16 +10,20 @@ Tests for `yowsup_gateway` layer.
 
 import unittest
 import time
+import os
+import tempfile
 from yowsup.layers import YowProtocolLayerTest
 from yowsup_gateway.layer import GatewayLayer
 from yowsup.layers.protocol_messages.protocolentities import TextMessageProtocolEntity
 from yowsup.layers.protocol_receipts.protocolentities import IncomingReceiptProtocolEntity
+from yowsup.layers.protocol_media.protocolentities import ResultRequestUploadIqProtocolEntity
 from yowsup.layers import YowLayerEvent
 from yowsup.layers.protocol_acks.protocolentities.test_ack_incoming import entity as incomingAckEntity
 from yowsup.layers.network import YowNetworkLayer
 from yowsup_gateway.exceptions import ConnectionError
 from yowsup_gateway.layer import ExitGateway
 from yowsup_gateway import YowsupGateway
+from yowsup_gateway.media import MediaUploadCache
 from . import success_protocol_entity
 try:
     import Queue
@@ -85,6 +89,60 @@ class GatewayLayerTest(YowProtocolLayerTest, GatewayLayer):
         self.assertEqual(msg_sent.getId(), self.ack_pending.pop())
         self.assertEqual(self.outbox, [msg_sent])
         
+    def test_send_message_prefetch_keys(self):
+        self.setProp(GatewayLayer.PROP_PREFETCH_KEYS, True)
+        message = self.send_message()
+        prefetch_event = self.lowerEventSink.pop()
+        self.assertEqual(prefetch_event.getName(), GatewayLayer.EVENT_PREFETCH_KEYS)
+        self.assertEqual(prefetch_event.getArg("jids"), [message[0] + "@s.whatsapp.net"])
+
+    def test_prefetch_keys(self):
+        self.onEvent(YowLayerEvent(GatewayLayer.EVENT_PREFETCH_KEYS, numbers=["341111111", "34111-222"]))
+        prefetch_event = self.lowerEventSink.pop()
+        self.assertEqual(prefetch_event.getArg("jids"), ["341111111@s.whatsapp.net", "34111-222@g.us"])
+
+    def send_media(self, path):
+        number = "341111111"
+        self.setProp(GatewayLayer.PROP_MEDIA_CACHE, self.media_cache)
+        self.onEvent(YowLayerEvent(GatewayLayer.EVENT_SEND_MEDIA, messages=[(number, path)]))
+
+    def test_send_media(self):
+        fd, path = tempfile.mkstemp(suffix=".mp3")
+        os.write(fd, b"audio")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.media_cache = MediaUploadCache()
+        self.send_media(path)
+        request_upload = self.lowerSink.pop()
+        self.assertEqual(request_upload.getTag(), "iq")
+        self.receive(ResultRequestUploadIqProtocolEntity(request_upload.getId(), "https://mms.example/a.mp3",
+                                                         "1.2.3.4", duplicate=True))
+        self.assertEqual(self.uploads_pending, {})
+        msg_sent = self.lowerSink.pop()
+        self.assertEqual(msg_sent.getMediaUrl(), "https://mms.example/a.mp3")
+        self.assertEqual(msg_sent.getTo(), "341111111@s.whatsapp.net")
+        self.assertEqual(self.ack_pending, [msg_sent.getId()])
+        # same content is not uploaded again
+        self.send_media(path)
+        msg_sent = self.lowerSink.pop()
+        self.assertEqual(msg_sent.getMediaUrl(), "https://mms.example/a.mp3")
+        self.assertEqual(self.lowerSink, [])
+
+    def test_upload_timeout(self):
+        fd, path = tempfile.mkstemp(suffix=".mp3")
+        os.write(fd, b"audio")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.media_cache = MediaUploadCache()
+        self.send_media(path)
+        self.lowerSink.pop()
+        self.expire_uploads()
+        self.assertEqual(len(self.uploads_pending), 1)
+        self.expire_uploads(time.time() + GatewayLayer.DEFAULT_UPLOAD_TIMEOUT + 1)
+        self.assertEqual(self.uploads_pending, {})
+        self.assertEqual(self.media_errors, [(path, "upload timed out")])
+        self.assert_broadcastEvent(YowLayerEvent(YowNetworkLayer.EVENT_STATE_DISCONNECT))
+
     def test_send_message_not_connected(self):
         self.connected = False
         with self.assertRaises(ConnectionError):
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_inbound
+----------------------------------
+
+Tests for `yowsup_gateway` inbound filtering.
+"""
+
+import time
+import unittest
+from yowsup.layers import YowLayerTest
+from yowsup.layers.protocol_messages.protocolentities import TextMessageProtocolEntity
+from yowsup.layers.protocol_receipts.protocolentities import IncomingReceiptProtocolEntity
+from yowsup_gateway.inbound import InboundFilterLayer, PassivePolicy, ReceiptsOnlyPolicy, AllowlistPolicy
+from .test_gateway_layer import DummyStack
+
+
+class InboundFilterLayerTest(YowLayerTest, InboundFilterLayer):
+
+    def setUp(self):
+        InboundFilterLayer.__init__(self)
+        self.setStack(DummyStack())
+
+    def receive_message(self, jid="bbb@s.whatsapp.net"):
+        node = TextMessageProtocolEntity("Received message", _from=jid).toProtocolTreeNode()
+        self.receive(node)
+        return node
+
+    def receive_receipt(self):
+        node = IncomingReceiptProtocolEntity("123", "sender@s.whatsapp.net", int(time.time())).toProtocolTreeNode()
+        self.receive(node)
+        return node
+
+    def test_no_policy(self):
+        node = self.receive_message()
+        self.assertEqual(self.upperSink, [node])
+        self.assertEqual(self.lowerSink, [])
+
+    def test_passive(self):
+        self.setProp(InboundFilterLayer.PROP_INBOUND_POLICY, PassivePolicy())
+        message = self.receive_message()
+        receipt = self.receive_receipt()
+        self.assertEqual(self.upperSink, [])
+        self.assertEqual(self.discarded, 2)
+        message_ack, receipt_ack = self.lowerSink
+        self.assertEqual(message_ack.tag, "receipt")
+        self.assertEqual(message_ack["id"], message["id"])
+        self.assertEqual(message_ack["to"], message["from"])
+        self.assertEqual(receipt_ack.tag, "ack")
+        self.assertEqual(receipt_ack["id"], receipt["id"])
+        self.assertEqual(receipt_ack["class"], "receipt")
+
+    def test_receipts_only(self):
+        self.setProp(InboundFilterLayer.PROP_INBOUND_POLICY, ReceiptsOnlyPolicy())
+        self.receive_message()
+        receipt = self.receive_receipt()
+        self.assertEqual(self.upperSink, [receipt])
+        self.assertEqual(len(self.lowerSink), 1)
+
+    def test_allowlist(self):
+        self.setProp(InboundFilterLayer.PROP_INBOUND_POLICY, AllowlistPolicy(["341111111"], receipts=False))
+        allowed = self.receive_message("341111111@s.whatsapp.net")
+        self.receive_message()
+        self.receive_receipt()
+        self.assertEqual(self.upperSink, [allowed])
+        self.assertEqual(self.discarded, 2)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
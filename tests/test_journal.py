@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_journal
+----------------------------------
+
+Tests for `yowsup_gateway` received messages journal.
+"""
+
+import threading
+import time
+import unittest
+from yowsup_gateway.journal import Journal
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.journal = Journal(max_size=3)
+        self.journal.open()
+
+    def test_since(self):
+        self.journal.append("a")
+        self.journal.append("b")
+        self.assertEqual(self.journal.since(0), (["a", "b"], 2))
+        self.assertEqual(self.journal.since(1), (["b"], 2))
+
+    def test_since_skips_discarded(self):
+        for entity in "abcde":
+            self.journal.append(entity)
+        self.assertEqual(self.journal.since(1), (["c", "d", "e"], 5))
+        self.assertEqual(self.journal.since(3), (["d", "e"], 5))
+
+    def test_wait_timeout(self):
+        start = time.time()
+        self.assertEqual(self.journal.since(0, max_wait=0.1), ([], 0))
+        self.assertTrue(time.time() - start >= 0.1)
+
+    def test_wait_until_append(self):
+        timer = threading.Timer(0.05, self.journal.append, args=("a",))
+        timer.start()
+        self.assertEqual(self.journal.since(0, max_wait=5), (["a"], 1))
+
+    def test_closed_does_not_wait(self):
+        threading.Timer(0.05, self.journal.close).start()
+        self.assertEqual(self.journal.since(0), ([], 0))
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_media
+----------------------------------
+
+Tests for `yowsup_gateway` media helpers.
+"""
+
+import os
+import tempfile
+import unittest
+from yowsup.common.tools import WATools
+from yowsup_gateway.exceptions import MediaError
+from yowsup_gateway.media import file_hash, MediaTemplate, MediaUploadCache
+
+
+class MediaTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".mp3")
+        os.write(fd, b"audio content" * 1000)
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_file_hash(self):
+        self.assertEqual(file_hash(self.path, chunk_size=10), WATools.getFileHashForUpload(self.path))
+
+    def test_template_build(self):
+        template = MediaTemplate(self.path)
+        entity = template.build("https://mms.example/file.mp3", "1.2.3.4", "341111111@s.whatsapp.net")
+        self.assertEqual(entity.getMediaType(), "audio")
+        self.assertEqual(entity.getMediaUrl(), "https://mms.example/file.mp3")
+        self.assertEqual(entity.getTo(), "341111111@s.whatsapp.net")
+        self.assertNotEqual(entity.getId(), template.build("url", None, "other").getId())
+
+    def test_template_unsupported(self):
+        with self.assertRaises(MediaError):
+            MediaTemplate(self.path + ".unknown")
+
+    def test_upload_cache(self):
+        cache = MediaUploadCache()
+        self.assertIsNone(cache.get("hash"))
+        cache.set("hash", "https://mms.example/file.mp3", "1.2.3.4")
+        self.assertEqual(cache.get("hash"), ("https://mms.example/file.mp3", "1.2.3.4"))
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_scheduler
+----------------------------------
+
+Tests for `yowsup_gateway` scheduled messages.
+"""
+
+import os
+import random
+import tempfile
+import unittest
+from yowsup_gateway.scheduler import TimerWheel, MessageScheduler
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wheel = TimerWheel(tick=1.0, slots=(4, 4, 4), now=0)
+
+    def test_due_now(self):
+        self.wheel.add(0, "a")
+        self.assertEqual(self.wheel.advance(0), ["a"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_never_early(self):
+        self.wheel.add(2.5, "a")
+        self.assertEqual(self.wheel.advance(2.9), [])
+        self.assertEqual(self.wheel.advance(3), ["a"])
+
+    def test_cascade_levels_and_overflow(self):
+        due = list(range(1, 200))
+        random.shuffle(due)
+        for timestamp in due:
+            self.wheel.add(timestamp, timestamp)
+        released = []
+        for now in range(1, 200):
+            items = self.wheel.advance(now)
+            self.assertEqual(items, [now])
+            released.extend(items)
+        self.assertEqual(len(released), 199)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_jump(self):
+        self.wheel.add(10000, "a")
+        self.assertEqual(self.wheel.advance(20000), ["a"])
+
+
+class MessageSchedulerTest(unittest.TestCase):
+
+    def test_persisted(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        scheduler = MessageScheduler(path)
+        scheduler.schedule([("341111111", "later", 2000000000), ("342222222", "now", 0)])
+        self.assertEqual(scheduler.due(), [("342222222", "now")])
+        scheduler = MessageScheduler(path)
+        self.assertEqual(len(scheduler), 1)
+        self.assertEqual(scheduler.due(), [])
+        self.assertEqual(scheduler.due(2000000001), [("341111111", "later")])
+        self.assertEqual(len(MessageScheduler(path)), 0)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Long running gateway process. It owns the whatsapp session and accepts
+message batches from local clients over HTTP, on a TCP port or a Unix
+socket::
+
+    yowsup-gateway serve --number 341111111 --password secret --socket /tmp/gateway.sock
+
+Clients post ``{"messages": [["number", "content"], ...]}`` to
+``/messages`` and read back one JSON line per message.
+"""
+from yowsup_gateway.stack import YowsupGateway
+from yowsup_gateway.exceptions import UnexpectedError
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+try:
+    import httplib
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+except ImportError:
+    import http.client as httplib
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn, UnixStreamServer
+
+
+logger = logging.getLogger(__name__)
+
+
+class Submission(object):
+    """
+    Messages posted by one client, waiting for the window they are sent in
+
+    :ivar list statuses: one dict per message once sent
+    """
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.statuses = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.statuses
+
+
+def message_statuses(messages, result=None, error=None):
+    """
+    Returns delivery status of each message from a gateway result
+    """
+    if error is not None:
+        return [{"number": number, "status": "error", "error": error} for number, _ in messages]
+    acked = result.acked
+    return [{"number": number, "id": entity.getId(),
+             "status": "acked" if entity.getId() in acked else "sent"}
+            for (number, _), entity in zip(messages, result.sent)]
+
+
+class GatewayDaemon(object):
+    """
+    Coalesces submissions from many clients into shared outbound windows,
+    so the session is opened once per window instead of once per client.
+    """
+
+    def __init__(self, gateway, window=0.5, max_batch=500):
+        """
+        :param YowsupGateway gateway: gateway owning the whatsapp session
+        :param float window: seconds to wait for more submissions before sending
+        :param int max_batch: messages that close a window before it expires
+        """
+        self.gateway = gateway
+        self.window = window
+        self.max_batch = max_batch
+        self.submissions = Queue.Queue()
+        self.running = False
+        self.thread = None
+
+    def submit(self, messages):
+        submission = Submission(messages)
+        self.submissions.put(submission)
+        return submission
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while self.running:
+            try:
+                first = self.submissions.get(timeout=0.1)
+            except Queue.Empty:
+                continue
+            self.send_window(self.collect_window(first))
+
+    def collect_window(self, first):
+        window = [first]
+        size = len(first.messages)
+        deadline = time.time() + self.window
+        while size < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                submission = self.submissions.get(timeout=remaining)
+            except Queue.Empty:
+                break
+            window.append(submission)
+            size += len(submission.messages)
+        return window
+
+    def send_window(self, window):
+        messages = [message for submission in window for message in submission.messages]
+        logger.debug("Sending window of %d submissions, %d messages", len(window), len(messages))
+        try:
+            statuses = message_statuses(messages, result=self.gateway.send_messages(messages))
+        except Exception as e:
+            logger.exception("Window not sent")
+            statuses = message_statuses(messages, error=str(e))
+        start = 0
+        for submission in window:
+            end = start + len(submission.messages)
+            submission.statuses = statuses[start:end]
+            start = end
+            submission.done.set()
+
+
+class GatewayRequestHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        if self.path != "/messages":
+            return self.send_error(404)
+        try:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            messages = [tuple(message) for message in json.loads(body.decode())["messages"]]
+        except (TypeError, ValueError, KeyError):
+            return self.send_error(400)
+        submission = self.server.gateway_daemon.submit(messages)
+        statuses = submission.wait()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for status in statuses:
+            self.wfile.write((json.dumps(status) + "\n").encode())
+
+    def address_string(self):
+        return str(self.client_address)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, daemon):
+        HTTPServer.__init__(self, address, GatewayRequestHandler)
+        self.gateway_daemon = daemon
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        UnixStreamServer.__init__(self, path, GatewayRequestHandler)
+        self.gateway_daemon = daemon
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, "localhost")
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def submit(messages, socket_path=None, host="127.0.0.1", port=8008):
+    """
+    Send messages through a running daemon
+
+    :param messages: list of (jid, message) tuples
+    :return: list of one status dict per message
+    """
+    conn = UnixHTTPConnection(socket_path) if socket_path else httplib.HTTPConnection(host, port)
+    try:
+        conn.request("POST", "/messages", json.dumps({"messages": messages}),
+                     {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        if response.status != 200:
+            raise UnexpectedError("Gateway daemon answered %d" % response.status)
+        return [json.loads(line) for line in response.read().decode().splitlines()]
+    finally:
+        conn.close()
+
+
+def serve(daemon, socket_path=None, host="127.0.0.1", port=8008):
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, daemon)
+    else:
+        server = ThreadingHTTPServer((host, port), daemon)
+    daemon.start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        daemon.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="yowsup-gateway")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="run gateway daemon")
+    serve_parser.add_argument("--number", required=True)
+    serve_parser.add_argument("--password", default=os.environ.get("YOWSUP_GATEWAY_PASSWORD"))
+    serve_parser.add_argument("--encryption", action="store_true")
+    serve_parser.add_argument("--socket", help="unix socket path, instead of host and port")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8008)
+    serve_parser.add_argument("--window", type=float, default=0.5)
+    serve_parser.add_argument("--max-batch", type=int, default=500)
+    args = parser.parse_args(argv)
+    if args.command != "serve":
+        parser.print_help()
+        return 1
+    if not args.password:
+        parser.error("--password or YOWSUP_GATEWAY_PASSWORD is required")
+    logging.basicConfig(level=logging.INFO)
+    gateway = YowsupGateway((args.number, args.password), args.encryption)
+    daemon = GatewayDaemon(gateway, args.window, args.max_batch)
+    serve(daemon, args.socket, args.host, args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+from yowsup.layers.axolotl import YowAxolotlLayer
+from yowsup.layers.axolotl.protocolentities import GetKeysIqProtocolEntity
+from axolotl.state.sessionrecord import SessionRecord
+from yowsup_gateway.cache import LRUCache
+from yowsup_gateway.layer import GatewayLayer
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class CachedAxolotlStore(object):
+    """
+    Axolotl store wrapper keeping recently used sessions and identities in
+    memory. Writes go through to the wrapped store.
+    """
+
+    def __init__(self, store, sessions, identities):
+        """
+        :param store: axolotl store to wrap
+        :param LRUCache sessions: cache for serialized session records
+        :param LRUCache identities: cache for serialized identity keys
+        """
+        self.store = store
+        self.sessions = sessions
+        self.identities = identities
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def loadSession(self, recipientId, deviceId):
+        serialized = self.sessions.get((recipientId, deviceId))
+        if serialized is not None:
+            return SessionRecord(serialized=serialized)
+        record = self.store.loadSession(recipientId, deviceId)
+        if not record.isFresh():
+            self.sessions.set((recipientId, deviceId), record.serialize())
+        return record
+
+    def containsSession(self, recipientId, deviceId):
+        if (recipientId, deviceId) in self.sessions:
+            return True
+        if not self.store.containsSession(recipientId, deviceId):
+            return False
+        # sessions from previous processes are cached on first use
+        self.loadSession(recipientId, deviceId)
+        return True
+
+    def storeSession(self, recipientId, deviceId, sessionRecord):
+        self.store.storeSession(recipientId, deviceId, sessionRecord)
+        self.sessions.set((recipientId, deviceId), sessionRecord.serialize())
+
+    def deleteSession(self, recipientId, deviceId):
+        self.sessions.delete((recipientId, deviceId))
+        self.store.deleteSession(recipientId, deviceId)
+
+    def deleteAllSessions(self, recipientId):
+        # cache is keyed by (recipient, device), rare enough to drop it all
+        self.sessions.clear()
+        self.store.deleteAllSessions(recipientId)
+
+    def saveIdentity(self, recipientId, identityKey):
+        self.store.saveIdentity(recipientId, identityKey)
+        self.identities.set(recipientId, identityKey.serialize())
+
+    def isTrustedIdentity(self, recipientId, identityKey):
+        serialized = identityKey.serialize()
+        if self.identities.get(recipientId) == serialized:
+            return True
+        if not self.store.isTrustedIdentity(recipientId, identityKey):
+            return False
+        self.identities.set(recipientId, serialized)
+        return True
+
+
+class GatewayAxolotlLayer(YowAxolotlLayer):
+    """
+    Axolotl layer used by the gateway when encryption is enabled.
+
+    Keeps a bounded cache over the axolotl store which survives between
+    gateway sessions, and fetches prekeys for lists of recipients in batched
+    requests instead of one request per new recipient.
+
+    :ivar set prefetching: jids with a prekeys request in flight
+    """
+
+    PROP_CACHE_SIZE = "org.openwhatsapp.yowsup.prop.gateway.axolotl.cache_size"
+    PROP_PREFETCH_BATCH = "org.openwhatsapp.yowsup.prop.gateway.axolotl.prefetch_batch"
+    DEFAULT_CACHE_SIZE = 4096
+    DEFAULT_PREFETCH_BATCH = 100
+
+    def __init__(self):
+        self.prefetching = set()
+        self.sessions_cache = LRUCache(self.DEFAULT_CACHE_SIZE)
+        self.identities_cache = LRUCache(self.DEFAULT_CACHE_SIZE)
+        super(GatewayAxolotlLayer, self).__init__()
+
+    @YowAxolotlLayer.store.setter
+    def store(self, store):
+        if store is not None and not isinstance(store, CachedAxolotlStore):
+            cache_size = self.getProp(self.PROP_CACHE_SIZE, self.DEFAULT_CACHE_SIZE)
+            self.sessions_cache.max_size = cache_size
+            self.identities_cache.max_size = cache_size
+            store = CachedAxolotlStore(store, self.sessions_cache, self.identities_cache)
+        YowAxolotlLayer.store.fset(self, store)
+
+    def __str__(self):
+        return "Gateway Axolotl Layer"
+
+    def onEvent(self, yowLayerEvent):
+        if yowLayerEvent.getName() == GatewayLayer.EVENT_PREFETCH_KEYS:
+            self.prefetch_keys(yowLayerEvent.getArg("jids"))
+            return True
+        return super(GatewayAxolotlLayer, self).onEvent(yowLayerEvent)
+
+    def prefetch_keys(self, jids):
+        """
+        Request prekeys for every jid without session in batches
+        """
+        missing = []
+        seen = set(self.skipEncJids) | self.prefetching
+        for jid in jids:
+            if jid in seen:
+                continue
+            seen.add(jid)
+            if not self.store.containsSession(jid.split('@')[0], 1):
+                missing.append(jid)
+        batch_size = self.getProp(self.PROP_PREFETCH_BATCH, self.DEFAULT_PREFETCH_BATCH)
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i + batch_size]
+            self.prefetching.update(batch)
+            logger.debug("Prefetching keys for %d jids", len(batch))
+            self._sendIq(GetKeysIqProtocolEntity(batch), self.on_prefetch_result, self.on_prefetch_error)
+
+    def on_prefetch_result(self, resultNode, getKeysEntity):
+        self.prefetching.difference_update(getKeysEntity.getJids())
+        self.onGetKeysResult(resultNode, getKeysEntity, self.processPendingMessages)
+
+    def on_prefetch_error(self, errorNode, getKeysEntity):
+        logger.warning("Prefetching keys failed, falling back to per recipient requests")
+        jids = getKeysEntity.getJids()
+        self.prefetching.difference_update(jids)
+        for jid in jids:
+            self.processPendingMessages(jid)
+
+    def handlePlaintextNode(self, node):
+        # wait for the batched keys request instead of asking again
+        if node["to"] in self.prefetching:
+            self.pendingMessages.setdefault(node["to"], []).append(node)
+            return
+        super(GatewayAxolotlLayer, self).handlePlaintextNode(node)
@@ -29,3 +29,10 @@ class AuthenticationError(YowsupGatewayError):
     password for number is incorrect. Check if registration was correct
     """
     pass
+
+
+class MediaError(YowsupGatewayError):
+    """
+    Raised when gateway cannot prepare or upload a media file
+    """
+    pass
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from yowsup.layers import YowLayer
+from yowsup.layers.protocol_receipts.protocolentities import OutgoingReceiptProtocolEntity
+from yowsup.layers.protocol_acks.protocolentities import OutgoingAckProtocolEntity
+from yowsup_gateway.layer import jid_for
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class InboundPolicy(object):
+    """
+    Decides which inbound messages and receipts reach the gateway. This one
+    accepts everything.
+
+    :cvar bool passive: log in as passive so whatsapp does not push offline
+    messages
+    """
+    passive = False
+
+    def accepts(self, node):
+        return True
+
+
+class PassivePolicy(InboundPolicy):
+    """
+    Send only sessions, nothing inbound is kept
+    """
+    passive = True
+
+    def accepts(self, node):
+        return False
+
+
+class ReceiptsOnlyPolicy(InboundPolicy):
+    """
+    Keep receipts of sent messages, discard incoming messages
+    """
+
+    def accepts(self, node):
+        return node.tag == "receipt"
+
+
+class AllowlistPolicy(InboundPolicy):
+    """
+    Keep messages from some senders only. Receipts are kept unless
+    ``receipts`` is False.
+    """
+
+    def __init__(self, numbers, receipts=True):
+        """
+        :param numbers: phone numbers, group ids or jids of accepted senders
+        :param bool receipts: accept receipts from any sender
+        """
+        self.jids = set(jid_for(number) for number in numbers)
+        self.receipts = receipts
+
+    def accepts(self, node):
+        if node.tag == "receipt" and self.receipts:
+            return True
+        return node["from"] in self.jids or node["participant"] in self.jids
+
+
+class InboundFilterLayer(YowLayer):
+    """
+    Layer below protocol layers which acks and discards the inbound messages
+    and receipts rejected by the gateway inbound policy, before they are
+    parsed into protocol entities.
+
+    :ivar int discarded: number of discarded messages and receipts
+    """
+
+    PROP_INBOUND_POLICY = "org.openwhatsapp.yowsup.prop.sendclient.inbound_policy"
+
+    def __init__(self):
+        super(InboundFilterLayer, self).__init__()
+        self.discarded = 0
+
+    def __str__(self):
+        return "Inbound Filter Layer"
+
+    def receive(self, node):
+        if node.tag in ("message", "receipt"):
+            policy = self.getProp(self.PROP_INBOUND_POLICY)
+            if policy is not None and not policy.accepts(node):
+                self.discard(node)
+                return
+        self.toUpper(node)
+
+    def discard(self, node):
+        if node.tag == "message":
+            ack = OutgoingReceiptProtocolEntity(node["id"], node["from"], participant=node["participant"])
+        else:
+            ack = OutgoingAckProtocolEntity(node["id"], "receipt", node["type"], node["from"])
+        self.discarded += 1
+        self.toLower(ack.toProtocolTreeNode())
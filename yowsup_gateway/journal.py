@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+import itertools
+import threading
+import time
+
+
+class Journal(object):
+    """
+    Bounded log of received entities numbered with a monotonically
+    increasing cursor. Readers wait for entities newer than their cursor.
+
+    :ivar int cursor: cursor of the last appended entity, 0 when empty
+    :ivar bool closed: readers do not wait while closed
+    """
+
+    def __init__(self, max_size=10000):
+        self.entries = deque(maxlen=max_size)
+        self.cursor = 0
+        self.closed = True
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, entity):
+        with self.condition:
+            self.cursor += 1
+            self.entries.append(entity)
+            self.condition.notify_all()
+
+    def since(self, cursor, max_wait=None):
+        """
+        Returns entities appended after cursor, waiting up to max_wait seconds
+        for one to arrive. Entities discarded because the journal is full are
+        skipped.
+
+        :return: (list of entities, new cursor) tuple
+        """
+        deadline = time.time() + max_wait if max_wait is not None else None
+        with self.condition:
+            while self.cursor <= cursor:
+                if self.closed:
+                    return [], cursor
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return [], cursor
+                self.condition.wait(remaining)
+            first = self.cursor - len(self.entries) + 1
+            offset = max(cursor + 1 - first, 0)
+            return list(itertools.islice(self.entries, offset, None)), self.cursor
+
+    def open(self):
+        with self.condition:
+            self.closed = False
+
+    def close(self):
+        """
+        Wake up waiting readers, used when the session ends
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
@@ -1,13 +1,16 @@
 # -*- coding: utf-8 -*-
 from yowsup.layers.interface import YowInterfaceLayer, ProtocolEntityCallback
-from yowsup.layers import EventCallback
+from yowsup.layers import EventCallback, YowLayerEvent
 from yowsup.layers.protocol_messages.protocolentities import \
     TextMessageProtocolEntity
 import logging
 from yowsup.layers.network import YowNetworkLayer
 from yowsup_gateway.results import SuccessfulResult
-from yowsup_gateway.exceptions import ConnectionError
-from functools import wraps
+from yowsup_gateway.exceptions import ConnectionError, MediaError
+from yowsup_gateway.media import MediaTemplate, MediaUploader
+from yowsup_gateway.journal import Journal
+from functools import wraps, partial
+import time
 
 
 logger = logging.getLogger(__name__)
@@ -20,6 +23,16 @@ def connection_required(f):
         return f(self, *args, **kwargs)
     return decorated_function
 
+def jid_for(number):
+    """
+    Returns the jid for a phone number, group id or jid
+    """
+    if '@' in number:
+        return number
+    elif '-' in number:
+        return "%s@g.us" % number
+    return "%s@s.whatsapp.net" % number
+
 class ExitGateway(Exception):
     """
     Raised by GatewayLayer to exit stack loop
@@ -34,11 +47,22 @@ class GatewayLayer(YowInterfaceLayer):
     :ivar list ack_pending: list with incoming ack messages to receive
     :ivar list inbox: list of received messages from whatsapp
     :ivar list outbox: list of sent messages to whatsapp
+    :ivar dict uploads_pending: media waiting for upload by content hash
+    :ivar dict uploads_started: time each pending upload was requested
+    :ivar list media_errors: (path, reason) of media that could not be sent
+    :ivar Journal journal: received messages numbered by cursor
     """
 
     CALLBACK_EVENT = "org.openwhatsapp.yowsup.prop.callback"
     PROP_MESSAGES = "org.openwhatsapp.yowsup.prop.sendclient.queue"
     EVENT_SEND_MESSAGES = "org.openwhatsapp.yowsup.prop.queue.sendmessage"
+    EVENT_PREFETCH_KEYS = "org.openwhatsapp.yowsup.prop.queue.prefetchkeys"
+    PROP_PREFETCH_KEYS = "org.openwhatsapp.yowsup.prop.sendclient.prefetchkeys"
+    EVENT_SEND_MEDIA = "org.openwhatsapp.yowsup.prop.queue.sendmedia"
+    PROP_MEDIA_CACHE = "org.openwhatsapp.yowsup.prop.sendclient.mediacache"
+    PROP_PERSISTENT = "org.openwhatsapp.yowsup.prop.sendclient.persistent"
+    PROP_UPLOAD_TIMEOUT = "org.openwhatsapp.yowsup.prop.sendclient.uploadtimeout"
+    DEFAULT_UPLOAD_TIMEOUT = 120
     
     def __init__(self):
 
@@ -47,7 +71,23 @@ class GatewayLayer(YowInterfaceLayer):
         self.connected = False
         self.inbox = []
         self.outbox = []
+        self.uploads_pending = {}
+        self.uploads_started = {}
+        self.media_errors = []
+        self.journal = Journal()
         
+    def reset(self):
+        """
+        Forget messages and pending flow of previous calls. Results already
+        returned keep their own lists.
+        """
+        self.ack_pending = []
+        self.inbox = []
+        self.outbox = []
+        self.uploads_pending = {}
+        self.uploads_started = {}
+        self.media_errors = []
+
     def _get_event_callback(self):
         return self.getProp(self.CALLBACK_EVENT, None)
       
@@ -57,8 +97,21 @@ class GatewayLayer(YowInterfaceLayer):
         
     def _receive_protocol_entity(self, protocol_entity):
         self.inbox.append(protocol_entity)
+        self.journal.append(protocol_entity)
+
+    def _disconnect_if_done(self):
+        if self.getProp(self.PROP_PERSISTENT, False):
+            return
+        if not self.ack_pending and not self.uploads_pending:
+            logger.info("Disconnect")
+            self.disconnect()
         
     def check_pending_flow(self):
+        if self.media_errors or self.uploads_pending:
+            failed = self.media_errors + [(template.path, "upload not finished")
+                                          for pending in self.uploads_pending.values()
+                                          for template, _ in pending]
+            raise MediaError("Media messages not sent %s" % str(failed))
         if self.ack_pending:
             pending_acks = [pending_ack for pending_ack in self.ack_pending]
             raise ConnectionError("Pending incoming Ack messages not received \
@@ -96,10 +149,8 @@ class GatewayLayer(YowInterfaceLayer):
         if entity.getId() in self.ack_pending:
             self.ack_pending.pop(self.ack_pending.index(entity.getId()))
             logger.info("Message sent:" + str(entity.getId()))
-             
-        if not len(self.ack_pending):
-            logger.info("Disconnect")
-            self.disconnect()
+
+        self._disconnect_if_done()
         
     @ProtocolEntityCallback("message")
     @connection_required
@@ -125,23 +176,106 @@ class GatewayLayer(YowInterfaceLayer):
         """
         Callback function when receiving event to send messages
         """
-        for message in yowLayerEvent.getArg("messages"):
+        messages = yowLayerEvent.getArg("messages")
+        if self.getProp(self.PROP_PREFETCH_KEYS, False):
+            # ask encryption layer for all recipient keys in a few requests
+            self.broadcastEvent(YowLayerEvent(self.EVENT_PREFETCH_KEYS,
+                                              jids=[jid_for(number) for number, _ in messages]))
+        for message in messages:
             number, content = message
-            if '@' in number:
-                message_protocol_entity = \
-                    TextMessageProtocolEntity(content, to=number)
-            elif '-' in number:
-                message_protocol_entity = \
-                    TextMessageProtocolEntity(content, to="%s@g.us" % number)
-            else:
-                message_protocol_entity = \
-                    TextMessageProtocolEntity(content,
-                                              to="%s@s.whatsapp.net" % number)
+            message_protocol_entity = \
+                TextMessageProtocolEntity(content, to=jid_for(number))
             # append the id of message to ack_pending list
             # which the id of message will be deleted when ack is received.
             self.ack_pending.append(message_protocol_entity.getId())
             self._send_protocol_entity(message_protocol_entity)
 
+    @EventCallback(EVENT_SEND_MEDIA)
+    @connection_required
+    def on_send_media(self, yowLayerEvent):
+        """
+        Callback function when receiving event to send media messages. Each
+        file is hashed once and uploaded only if its content is not in the
+        media cache.
+        """
+        templates = {}
+        for message in yowLayerEvent.getArg("messages"):
+            number, path = message[:2]
+            caption = message[2] if len(message) > 2 else None
+            if (path, caption) not in templates:
+                templates[(path, caption)] = (MediaTemplate(path, caption), [])
+            templates[(path, caption)][1].append(jid_for(number))
+        cache = self.getProp(self.PROP_MEDIA_CACHE)
+        for template, jids in templates.values():
+            uploaded = cache.get(template.file_hash) if cache else None
+            if uploaded:
+                self._send_media(template, jids, *uploaded)
+            elif template.file_hash in self.uploads_pending:
+                self.uploads_pending[template.file_hash].append((template, jids))
+            else:
+                self.uploads_pending[template.file_hash] = [(template, jids)]
+                self.uploads_started[template.file_hash] = time.time()
+                self._sendIq(template.request_upload(),
+                             partial(self.on_request_upload_result, template, jids[0]),
+                             partial(self.on_request_upload_error, template))
+
+    def _send_media(self, template, jids, url, ip):
+        for jid in jids:
+            message_protocol_entity = template.build(url, ip, jid)
+            self.ack_pending.append(message_protocol_entity.getId())
+            self._send_protocol_entity(message_protocol_entity)
+
+    def on_request_upload_result(self, template, jid, result_entity, request_entity):
+        if result_entity.isDuplicate():
+            return self.on_media_uploaded(template.file_hash, result_entity.getUrl(), result_entity.getIp())
+        # upload runs in its own thread, get back to the loop to send messages
+        ip = result_entity.getIp()
+        execute = self.getStack().execDetached
+        uploader = MediaUploader(
+            jid, self.getOwnJid(), template.path, result_entity.getUrl(),
+            success=lambda path, url: execute(lambda: self.on_media_uploaded(template.file_hash, url, ip)),
+            error=lambda path, reason: execute(lambda: self.on_media_upload_error(template.file_hash, reason)))
+        uploader.start()
+
+    def on_request_upload_error(self, template, error_entity, request_entity):
+        self.on_media_upload_error(template.file_hash, "upload request rejected")
+
+    def on_media_uploaded(self, file_hash, url, ip):
+        cache = self.getProp(self.PROP_MEDIA_CACHE)
+        if cache:
+            cache.set(file_hash, url, ip)
+        self.uploads_started.pop(file_hash, None)
+        for template, jids in self.uploads_pending.pop(file_hash, []):
+            self._send_media(template, jids, url, ip)
+        self._disconnect_if_done()
+
+    def on_media_upload_error(self, file_hash, reason):
+        self.uploads_started.pop(file_hash, None)
+        for template, _ in self.uploads_pending.pop(file_hash, []):
+            logger.error("Media %s not sent: %s", template.path, reason)
+            self.media_errors.append((template.path, reason))
+        self._disconnect_if_done()
+
+    def expire_uploads(self, now=None):
+        """
+        Fail uploads not finished in time, neither the upload request nor
+        the upload itself are waited for longer
+        """
+        timeout = self.getProp(self.PROP_UPLOAD_TIMEOUT, self.DEFAULT_UPLOAD_TIMEOUT)
+        now = time.time() if now is None else now
+        for file_hash, started in list(self.uploads_started.items()):
+            if now - started > timeout:
+                self.on_media_upload_error(file_hash, "upload timed out")
+
+    @EventCallback(EVENT_PREFETCH_KEYS)
+    @connection_required
+    def on_prefetch_keys(self, yowLayerEvent):
+        """
+        Callback function when receiving event to prefetch encryption keys
+        """
+        self.broadcastEvent(YowLayerEvent(self.EVENT_PREFETCH_KEYS,
+                                          jids=[jid_for(number) for number in yowLayerEvent.getArg("numbers")]))
+
     @EventCallback(YowNetworkLayer.EVENT_STATE_DISCONNECTED)
     @connection_required
     def on_disconnected(self, yowLayerEvent):
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+from yowsup.layers.protocol_media.protocolentities import DownloadableMediaMessageProtocolEntity, \
+    ImageDownloadableMediaMessageProtocolEntity, RequestUploadIqProtocolEntity
+from yowsup.common.tools import ImageTools
+from yowsup.env import YowsupEnv
+from yowsup_gateway.exceptions import MediaError
+import base64
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import sqlite3
+import threading
+import time
+try:
+    import httplib
+    from urlparse import urlparse
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urlparse
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_hash(path, chunk_size=CHUNK_SIZE):
+    """
+    Returns base64 sha256 of a file as whatsapp expects it for uploads,
+    reading it in chunks so big files are never fully loaded in memory
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return base64.b64encode(sha.digest()).decode()
+
+
+class MediaTemplate(object):
+    """
+    Media file metadata computed once and used to build a message entity for
+    each recipient.
+
+    :ivar str file_hash: base64 sha256 of the content
+    :ivar str media_type: image, audio or video
+    """
+
+    def __init__(self, path, caption=None):
+        self.path = path
+        self.caption = caption
+        self.mimetype = mimetypes.guess_type(path)[0]
+        self.media_type = self.mimetype.split('/')[0] if self.mimetype else None
+        if self.media_type not in RequestUploadIqProtocolEntity.TYPES_MEDIA:
+            raise MediaError("Unsupported media type for %s" % path)
+        self.size = os.path.getsize(path)
+        self.file_name = os.path.basename(path)
+        self.file_hash = file_hash(path)
+        self.preview = None
+        self.dimensions = None
+        if self.media_type == DownloadableMediaMessageProtocolEntity.MEDIA_TYPE_IMAGE:
+            self.dimensions = ImageTools.getImageDimensions(path)
+            if not self.dimensions:
+                raise MediaError("Could not determine image dimensions of %s" % path)
+            self.preview = ImageTools.generatePreviewFromImage(path)
+
+    def request_upload(self):
+        """
+        Returns the iq entity asking whatsapp where to upload the content
+        """
+        return RequestUploadIqProtocolEntity(self.media_type, b64Hash=self.file_hash, size=self.size)
+
+    def build(self, url, ip, to):
+        """
+        Returns a media message entity for a recipient
+        """
+        kwargs = dict(mimeType=self.mimetype, fileHash=self.file_hash, url=url, ip=ip,
+                      size=self.size, fileName=self.file_name, to=to, preview=self.preview)
+        if self.dimensions:
+            width, height = self.dimensions
+            return ImageDownloadableMediaMessageProtocolEntity(encoding="raw", width=width, height=height,
+                                                               caption=self.caption, **kwargs)
+        return DownloadableMediaMessageProtocolEntity(self.media_type, **kwargs)
+
+
+class MediaUploadCache(object):
+    """
+    Uploaded media urls by content hash, so the same file is uploaded only
+    once. Kept in a sqlite database, in memory unless a path is given.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS media "
+                          "(hash TEXT PRIMARY KEY, url TEXT, ip TEXT, created REAL)")
+        self.conn.commit()
+
+    def get(self, media_hash):
+        """
+        :return: (url, ip) tuple or None when the content was not uploaded
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT url, ip FROM media WHERE hash = ?", (media_hash,)).fetchone()
+        return tuple(row) if row else None
+
+    def set(self, media_hash, url, ip=None):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?)",
+                              (media_hash, url, ip, time.time()))
+            self.conn.commit()
+
+
+class MediaUploader(threading.Thread):
+    """
+    Uploads a file to whatsapp media servers in a thread, streaming it from
+    disk in chunks
+    """
+
+    BOUNDARY = "zzXXzzYYzzXXzzQQ"
+    TIMEOUT = 60
+
+    def __init__(self, jid, account_jid, path, upload_url, success=None, error=None,
+                 chunk_size=CHUNK_SIZE):
+        super(MediaUploader, self).__init__()
+        self.daemon = True
+        self.jid = jid
+        self.account_jid = account_jid
+        self.path = path
+        self.upload_url = upload_url
+        self.success = success
+        self.error = error
+        self.chunk_size = chunk_size
+
+    def run(self):
+        try:
+            url = self.upload()
+        except Exception as e:
+            logger.exception("Error uploading %s", self.path)
+            if self.error:
+                self.error(self.path, str(e))
+        else:
+            if self.success:
+                self.success(self.path, url)
+
+    def upload(self):
+        file_name = os.path.basename(self.path)
+        crypto_name = hashlib.md5(file_name.encode()).hexdigest() + os.path.splitext(file_name)[1]
+        head = ("--%(b)s\r\nContent-Disposition: form-data; name=\"to\"\r\n\r\n%(to)s\r\n"
+                "--%(b)s\r\nContent-Disposition: form-data; name=\"from\"\r\n\r\n%(from)s\r\n"
+                "--%(b)s\r\nContent-Disposition: form-data; name=\"file\"; filename=\"%(name)s\"\r\n"
+                "Content-Type: %(type)s\r\n\r\n") % {
+            "b": self.BOUNDARY, "to": self.jid, "from": self.account_jid.replace("@whatsapp.net", ""),
+            "name": crypto_name, "type": mimetypes.guess_type(file_name)[0]}
+        head = head.encode()
+        tail = ("\r\n--%s--\r\n" % self.BOUNDARY).encode()
+
+        target = urlparse(self.upload_url)
+        conn = httplib.HTTPSConnection(target.netloc, timeout=self.TIMEOUT)
+        try:
+            conn.putrequest("POST", target.path + ("?" + target.query if target.query else ""))
+            conn.putheader("Content-Type", "multipart/form-data; boundary=%s" % self.BOUNDARY)
+            conn.putheader("User-Agent", YowsupEnv.getCurrent().getUserAgent())
+            conn.putheader("Content-Length", str(len(head) + os.path.getsize(self.path) + len(tail)))
+            conn.endheaders()
+            conn.send(head)
+            with open(self.path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    conn.send(chunk)
+            conn.send(tail)
+            body = conn.getresponse().read().decode()
+        finally:
+            conn.close()
+        for line in body.splitlines():
+            if line.startswith("{"):
+                url = json.loads(line).get("url")
+                if url:
+                    return url
+        raise MediaError("Upload response without url")
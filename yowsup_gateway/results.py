@@ -9,15 +9,29 @@ class SuccessfulResult(object):
         
     :ivar list inbox: received messages from whatsapp
     :ivar list outbox: sent message to whatsapp
+    :ivar int cursor: cursor of last received message in persistent sessions
     """
-    def __init__(self, inbox=None, outbox=None):
+    def __init__(self, inbox=None, outbox=None, cursor=None):
         self.inbox = inbox
         self.outbox = outbox
+        self.cursor = cursor
             
     def __repr__(self):        
         return "<inbox: %s, outbox: %s at %d>" % \
             (self.inbox.__repr__(), self.outbox.__repr__(), id(self))
 
+    @property
+    def sent(self):
+        """ Returns sent messages in the order they were sent
+        """
+        return [entity for entity in self.outbox if entity.getTag() == "message"]
+
+    @property
+    def acked(self):
+        """ Returns ids of sent messages acknowledged by whatsapp
+        """
+        return set(entity.getId() for entity in self.inbox if entity.getTag() == "ack")
+
     @property
     def is_success(self):
         """ Returns whether the result from the gateway is a successful response
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timer wheel. Adding an item and releasing due items cost
+    O(1) per item whatever the number of scheduled items.
+
+    Level 0 has one slot per tick, each upper level slot covers a whole
+    turn of the level below and its items cascade down when reached.
+    """
+
+    def __init__(self, tick=1.0, slots=(256, 64, 64, 64), now=None):
+        """
+        :param float tick: seconds per slot of the lowest level
+        :param slots: number of slots per level
+        """
+        self.tick = tick
+        self.slots = slots
+        self.granularity = [1]
+        for size in slots[:-1]:
+            self.granularity.append(self.granularity[-1] * size)
+        self.levels = [[[] for _ in range(size)] for size in slots]
+        self.sizes = [0] * len(slots)
+        self.overflow = []
+        self.ready = []
+        self.current = self._ticks(time.time() if now is None else now)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _ticks(self, timestamp):
+        return int(timestamp // self.tick)
+
+    def add(self, due, item):
+        """
+        :param float due: timestamp when item is due
+        """
+        self.count += 1
+        # round up so items are never released before they are due
+        self._place(int(math.ceil(due / self.tick)), item)
+
+    def _place(self, due_tick, item):
+        delta = due_tick - self.current
+        if delta <= 0:
+            self.ready.append(item)
+            return
+        for level, size in enumerate(self.slots):
+            if delta < self.granularity[level] * size:
+                index = (due_tick // self.granularity[level]) % size
+                self.levels[level][index].append((due_tick, item))
+                self.sizes[level] += 1
+                return
+        self.overflow.append((due_tick, item))
+
+    def advance(self, now=None):
+        """
+        Move the wheel to now and return items due meanwhile
+        """
+        target = self._ticks(time.time() if now is None else now)
+        while self.current < target:
+            if self.count == len(self.ready):
+                # nothing scheduled in the wheel, jump straight to now
+                self.current = target
+                break
+            self.current = min(self._next_tick(), target)
+            self._cascade()
+        ready, self.ready = self.ready, []
+        self.count -= len(ready)
+        return ready
+
+    def _next_tick(self):
+        # nothing happens before the next turn of the lowest non empty level
+        for level, size in enumerate(self.sizes):
+            if size:
+                step = self.granularity[level]
+                break
+        else:
+            step = self.granularity[-1] * self.slots[-1]
+        return (self.current // step + 1) * step
+
+    def _cascade(self):
+        for level in range(len(self.slots) - 1, 0, -1):
+            if self.current % self.granularity[level] == 0:
+                index = (self.current // self.granularity[level]) % self.slots[level]
+                bucket, self.levels[level][index] = self.levels[level][index], []
+                self.sizes[level] -= len(bucket)
+                if level == len(self.slots) - 1 and index == 0:
+                    bucket, self.overflow = bucket + self.overflow, []
+                for due_tick, item in bucket:
+                    self._place(due_tick, item)
+        index = self.current % self.slots[0]
+        bucket, self.levels[0][index] = self.levels[0][index], []
+        self.sizes[0] -= len(bucket)
+        self.ready.extend(item for _, item in bucket)
+
+
+class MessageScheduler(object):
+    """
+    Messages to send at a given time. They are kept in a sqlite database,
+    in memory unless a path is given, and indexed in a :class:`TimerWheel`.
+    A message is removed from the database when it is released to be sent.
+    """
+
+    def __init__(self, path=":memory:", tick=1.0):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS scheduled "
+                          "(id INTEGER PRIMARY KEY, send_at REAL, number TEXT, content TEXT)")
+        self.conn.commit()
+        self.wheel = TimerWheel(tick)
+        for _id, send_at in self.conn.execute("SELECT id, send_at FROM scheduled"):
+            self.wheel.add(send_at, _id)
+
+    def __len__(self):
+        return len(self.wheel)
+
+    def schedule(self, messages):
+        """
+        :param messages: list of (jid, message, send_at timestamp) tuples
+        """
+        with self.lock:
+            for number, content, send_at in messages:
+                cursor = self.conn.execute("INSERT INTO scheduled (send_at, number, content) VALUES (?, ?, ?)",
+                                           (send_at, number, content))
+                self.wheel.add(send_at, cursor.lastrowid)
+            self.conn.commit()
+
+    def due(self, now=None):
+        """
+        Release messages due until now
+
+        :return: list of (jid, message) tuples
+        """
+        with self.lock:
+            ids = self.wheel.advance(now)
+            if not ids:
+                return []
+            messages = []
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                messages.extend(self.conn.execute("SELECT number, content FROM scheduled WHERE id IN (%s) "
+                                                  "ORDER BY send_at, id" % marks, chunk).fetchall())
+                self.conn.execute("DELETE FROM scheduled WHERE id IN (%s)" % marks, chunk)
+            self.conn.commit()
+        logger.debug("Releasing %d scheduled messages", len(messages))
+        return [tuple(message) for message in messages]
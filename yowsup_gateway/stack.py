@@ -1,15 +1,21 @@
 # -*- coding: utf-8 -*-
 from yowsup.stacks import YowStack
 from yowsup_gateway.layer import GatewayLayer, ExitGateway
+from yowsup_gateway.results import SuccessfulResult
+from yowsup_gateway.inbound import InboundFilterLayer
+from yowsup_gateway.scheduler import MessageScheduler
 from yowsup.layers import YowLayerEvent
 from yowsup import stacks
-from yowsup.layers.auth import AuthError
+from yowsup.layers.auth import AuthError, YowAuthenticationProtocolLayer
 from yowsup.layers.network import YowNetworkLayer
 import asyncore
 import time
 import logging
-from yowsup_gateway.exceptions import AuthenticationError, ConnectionError, ConfigurationError, UnexpectedError
+from yowsup_gateway.exceptions import AuthenticationError, ConnectionError, ConfigurationError, UnexpectedError, \
+    MediaError
+from yowsup_gateway.media import MediaUploadCache
 import sys
+import threading
 try:
     import Queue
 except ImportError:
@@ -25,36 +31,49 @@ class YowsupGateway(YowStack):
     :ivar SuccessfulResult result: List of inbox and outbox messages
     :ivar Queue detached_queue: Queue with callbacks to execute after 
     disconnection
+    :ivar Thread session: thread running the persistent session, if open
+    :ivar Exception session_error: error which ended last persistent session
     """
     
-    def __init__(self, credentials, encryption=False, top_layers=None):
+    def __init__(self, credentials, encryption=False, top_layers=None, media_cache=None,
+                 inbound_policy=None, scheduler=None):
         """
         :param credentials: number and registed password
         :param bool encryptionEnabled:  E2E encryption enabled/ disabled
         :params top_layers: tuple of layer between :class:`yowsup_gateway.layer.GatewayLayer` 
         and Yowsup Core Layers  
+        :param MediaUploadCache media_cache: uploaded media urls, in memory by default
+        :param InboundPolicy inbound_policy: inbound messages and receipts to keep,
+        all of them by default
+        :param MessageScheduler scheduler: scheduled messages, in memory by default
         """
         top_layers = (GatewayLayer,) + top_layers if top_layers else (GatewayLayer,)
+        layers = (
+            top_layers +
+            (stacks.YOWSUP_PROTOCOL_LAYERS_FULL,) +
+            (InboundFilterLayer,)
+        )
         if encryption:
-            from yowsup.layers.axolotl import YowAxolotlLayer
-            layers = (
-                top_layers +
-                (stacks.YOWSUP_PROTOCOL_LAYERS_FULL,) +
-                (YowAxolotlLayer,) + 
-                stacks.YOWSUP_CORE_LAYERS
-            )
-        else:
-            layers = (
-                top_layers +
-                stacks.YOWSUP_FULL_STACK 
-            )
+            from yowsup_gateway.encryption import GatewayAxolotlLayer
+            layers += (GatewayAxolotlLayer,)
+        layers += stacks.YOWSUP_CORE_LAYERS
         try:
             super(YowsupGateway, self).__init__(layers)
         except ValueError as e:
             raise ConfigurationError(e.args[0])
         self.setCredentials(credentials)
+        self.setProp(GatewayLayer.PROP_PREFETCH_KEYS, encryption)
+        self.setProp(GatewayLayer.PROP_MEDIA_CACHE, media_cache or MediaUploadCache())
+        self.setProp(InboundFilterLayer.PROP_INBOUND_POLICY, inbound_policy)
         self.detached_queue = Queue.Queue()
         self.result = None
+        self.session = None
+        self.session_error = None
+        self.scheduler = scheduler or MessageScheduler()
+
+    @property
+    def gateway_layer(self):
+        return self.getLayer(-1)
         
     def execDetached(self, fn):
         return self.detached_queue.put(fn)
@@ -72,21 +91,45 @@ class YowsupGateway(YowStack):
                 callback()
             except Queue.Empty:
                 pass
+            if self.gateway_layer.uploads_started:
+                self.gateway_layer.expire_uploads()
+            if self.getProp(GatewayLayer.PROP_PERSISTENT, False):
+                self.release_scheduled()
+                continue
             logger.debug("LOOP : %d enqueued, waiting to finish" % len(asyncore.socket_map))
             if len(asyncore.socket_map) == 0:
                 self.broadcastEvent(YowLayerEvent(YowNetworkLayer.EVENT_STATE_DISCONNECT))
-            if int(time.time()) - start > 1:
+            if int(time.time()) - start > 1 and not self.gateway_layer.uploads_pending:
                 logger.debug("LOOP : Timeout")
                 self.broadcastEvent(YowLayerEvent(YowNetworkLayer.EVENT_STATE_DISCONNECT))
         
-    def execute(self):        
+    def release_scheduled(self):
+        """
+        Send scheduled messages which are due, in the persistent session
+        """
+        if not self.gateway_layer.connected:
+            return
+        messages = self.scheduler.due()
+        if messages:
+            self.gateway_layer.onEvent(YowLayerEvent(GatewayLayer.EVENT_SEND_MESSAGES, messages=messages))
+
+    def execute(self, **loop_kwargs):
+        if self.session is not None and self.session is not threading.current_thread():
+            raise ConnectionError("A persistent session is open, close it first")
+        loop_kwargs = dict(dict(timeout=0.1, discrete=0.2, count=4), **loop_kwargs)
+        self.gateway_layer.reset()
+        policy = self.getProp(InboundFilterLayer.PROP_INBOUND_POLICY)
+        if policy is not None:
+            self.setProp(YowAuthenticationProtocolLayer.PROP_PASSIVE, policy.passive)
         try:
             self.broadcastEvent(YowLayerEvent(YowNetworkLayer.EVENT_STATE_CONNECT))
-            self.loop(timeout=0.1, discrete=0.2, count=4)
+            self.loop(**loop_kwargs)
         except AuthError as e:
             raise AuthenticationError("Authentication Error: {0}".format(e))
         except ConnectionError as e:
             raise ConnectionError("{0}".format(e))
+        except MediaError as e:
+            raise MediaError("{0}".format(e))
         except ExitGateway:
             return self.result
         except:
@@ -94,22 +137,99 @@ class YowsupGateway(YowStack):
                         
     def send_messages(self, messages):
         """
-        Send text messages
+        Send text messages. Messages and receipts received meanwhile are
+        kept or discarded following the gateway inbound policy.
         
         :param messages: list of (jid, message) tuples
         :return: list of inbox and outbox messages
         :rtype: SuccessfulResult
         """
         self.result = None
-        # With this option do not receive messages
-        # self.setProp(YowAuthenticationProtocolLayer.PROP_PASSIVE, True)
         self.setProp(GatewayLayer.CALLBACK_EVENT, YowLayerEvent(GatewayLayer.EVENT_SEND_MESSAGES, messages=messages))
         return self.execute()
         
-    def receive_messages(self):
+    def schedule_messages(self, messages):
+        """
+        Schedule text messages to be sent at a given time. They are sent in
+        batches by the persistent session, see :meth:`open`.
+
+        :param messages: list of (jid, message, send_at timestamp) tuples
+        """
+        self.scheduler.schedule(messages)
+
+    def send_media(self, messages):
+        """
+        Send image, audio or video files. Files are streamed from disk and
+        the same content is uploaded once for all recipients and later calls.
+
+        :param messages: list of (jid, path) or (jid, path, caption) tuples
+        :return: list of inbox and outbox messages
+        :rtype: SuccessfulResult
+        """
+        self.result = None
+        self.setProp(GatewayLayer.CALLBACK_EVENT, YowLayerEvent(GatewayLayer.EVENT_SEND_MEDIA, messages=messages))
+        return self.execute()
+
+    def prefetch_keys(self, numbers):
+        """
+        Fetch encryption keys for recipients ahead of sending. Keys are
+        requested in batches and sessions are kept for next sends.
+        Does nothing useful without encryption.
+
+        :param numbers: list of phone numbers, group ids or jids
+        :return: list of inbox and outbox messages
+        :rtype: SuccessfulResult
+        """
+        self.result = None
+        self.setProp(GatewayLayer.CALLBACK_EVENT, YowLayerEvent(GatewayLayer.EVENT_PREFETCH_KEYS, numbers=numbers))
+        return self.execute()
+
+    def open(self):
+        """
+        Open a persistent session in background. It stays connected until
+        :meth:`close` and received messages are read with
+        ``receive_messages(since=cursor)``.
+        """
+        if self.session is not None:
+            return
+        self.result = None
+        self.session_error = None
+        self.setProp(GatewayLayer.PROP_PERSISTENT, True)
+        self.setProp(GatewayLayer.CALLBACK_EVENT, None)
+        self.gateway_layer.journal.open()
+        self.session = threading.Thread(target=self._run_session)
+        self.session.daemon = True
+        self.session.start()
+
+    def _run_session(self):
+        try:
+            self.execute(timeout=0.05, discrete=0, count=1)
+        except Exception as e:
+            logger.error("Persistent session finished: %s", e)
+            self.session_error = e
+        finally:
+            self.setProp(GatewayLayer.PROP_PERSISTENT, False)
+            self.session = None
+            self.gateway_layer.journal.close()
+
+    def close(self):
+        """
+        Close the persistent session
+        """
+        session = self.session
+        if session is None:
+            return
+        self.execDetached(lambda: self.broadcastEvent(YowLayerEvent(YowNetworkLayer.EVENT_STATE_DISCONNECT)))
+        session.join()
+
+    def receive_messages(self, since=None, max_wait=None):
         """
         Returns messages received from Whatsapp
         
+        :param int since: cursor of last received message, 0 at first call.
+        When given, a persistent session is opened and kept between calls and
+        messages are returned as soon as they arrive.
+        :param float max_wait: seconds to wait for messages after ``since``
         :return: list of inbox and outbox messages
         :rtype: SuccessfulResult
         
@@ -117,8 +237,23 @@ class YowsupGateway(YowStack):
         
             received_messages = result.inbox
             sent_messages = result.outbox
+
+        Polling a persistent session::
+
+            cursor = 0
+            while True:
+                result = gateway.receive_messages(since=cursor, max_wait=30)
+                cursor = result.cursor
          
         """
-        self.result = None
-        self.setProp(GatewayLayer.CALLBACK_EVENT, None)
-        return self.execute()
+        if since is None:
+            self.result = None
+            self.setProp(GatewayLayer.CALLBACK_EVENT, None)
+            return self.execute()
+        if self.session is None:
+            if self.session_error is not None:
+                error, self.session_error = self.session_error, None
+                raise error
+            self.open()
+        inbox, cursor = self.gateway_layer.journal.since(since, max_wait)
+        return SuccessfulResult(inbox, [], cursor)